@@ -1,69 +1,211 @@
+import hashlib
 import json
 import os
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import logging
 
+try:
+    # orjson (C implementation, expected in the Lambda layer) is much faster on the
+    # Bedrock hot path; fall back to the standard library when it isn't installed
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+    def _json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
 # --- Configure logging to work with AWS CloudWatch ---
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 # ----------------------------------------------------
 
+# --- Shared boto3 client configuration ---
+# Bounded timeouts avoid multi-minute hangs on a stuck connection, one retry
+# covers transient errors, and TCP keepalive keeps the idle HTTPS connection
+# usable across warm invocations.
+_BEDROCK_WORKERS = 8
+_UPLOAD_WORKERS = 8
+_BOTO_CONFIG = Config(
+    connect_timeout=3,
+    read_timeout=30,
+    retries={"max_attempts": 2, "mode": "standard"},
+    tcp_keepalive=True,
+    # Batch workers and the handler thread can all use the S3 client at once;
+    # the default pool of 10 would drop connections instead of reusing them
+    max_pool_connections=_BEDROCK_WORKERS + _UPLOAD_WORKERS + 1,
+)
+# ----------------------------------------------------
+
+
+# --- Part 1: Amazon Bedrock Integration (using Claude 3 Haiku) ---
+
+# The static parts of the prompt are built once at import time; only the
+# user's description is spliced in per request.
+_ARCH_PROMPT_PREFIX = """
+You are an expert system architect. Your task is to convert a natural language description
+of a cloud architecture into a structured JSON object.
+
+The JSON must have two top-level keys: "nodes" and "edges".
+
+1.  **nodes**: A list of all components.
+    - `id`: A unique, simple Python-variable-safe string (e.g., "user", "alb", "rds_db").
+    - `label`: The text to display on the icon (e.g., "Application Load Balancer"). Do not use newlines.
+    - `type`: The type of the component. This is CRITICAL. Choose from this list:
+      - `aws.compute.ec2_auto_scaling`
+      - `aws.network.route53`, `aws.network.elb_application_load_balancer`
+      - `aws.storage.s3`
+      - `aws.database.rds_postgresql_instance`
+      - `user` (for human users)
+      - `generic_client` (for web browsers, mobile apps)
+
+2.  **edges**: A list of connections between the nodes.
+    - `source`: The `id` of the starting node.
+    - `target`: The `id` of the ending node.
+    - `label`: A short description of the connection.
+
+USER'S ARCHITECTURE DESCRIPTION:
+---
+"""
+_ARCH_PROMPT_SUFFIX = "\n---\n"
+
+# Forcing Claude to call this tool makes Bedrock return the architecture as an
+# already-parsed JSON object instead of free text that may be wrapped in markdown.
+_ARCHITECTURE_TOOL = {
+    "name": "emit_architecture",
+    "description": "Emit the nodes and edges of the described cloud architecture.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "nodes": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string"},
+                        "label": {"type": "string"},
+                        "type": {"type": "string"},
+                    },
+                    "required": ["id", "label", "type"],
+                },
+            },
+            "edges": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "source": {"type": "string"},
+                        "target": {"type": "string"},
+                        "label": {"type": "string"},
+                    },
+                    "required": ["source", "target"],
+                },
+            },
+        },
+        "required": ["nodes", "edges"],
+    },
+}
+
+# Fixed fields of the Bedrock request; "messages" is filled in per call.
+_REQUEST_BODY_TEMPLATE = {
+    "anthropic_version": "bedrock-2023-05-31",
+    "max_tokens": 4096,
+    "tools": [_ARCHITECTURE_TOOL],
+    "tool_choice": {"type": "tool", "name": _ARCHITECTURE_TOOL["name"]},
+}
 
-# --- Part 1: Amazon Bedrock Integration (using Claude 3 Sonnet) ---
 
 class BedrockProcessor:
     """
-    Processes natural language input using Anthropic's Claude 3 Sonnet model
+    Processes natural language input using Anthropic's Claude 3 Haiku model
     on Amazon Bedrock to generate structured JSON.
     """
-    def __init__(self, region_name=None):
+    def __init__(self, region_name=None, s3_client=None, cache_bucket=None):
         try:
             # If region is not specified, boto3 will use the region of the Lambda function
-            self.client = boto3.client(service_name='bedrock-runtime', region_name=region_name)
-            self.model_id = 'anthropic.claude-3-sonnet-v1:0'
+            self.client = boto3.client(service_name='bedrock-runtime', region_name=region_name, config=_BOTO_CONFIG)
+            self.model_id = 'anthropic.claude-3-haiku-20240307-v1:0'
             logger.info(f"✅ [Bedrock] Client configured successfully for model '{self.model_id}'.")
         except Exception as e:
             logger.error(f"❌ ERROR: Could not create Bedrock runtime client: {e}")
             raise
+        # Optional S3-backed cache of model output, keyed by a hash of the input text
+        self.s3_client = s3_client
+        self.cache_bucket = cache_bucket if s3_client else None
+        self._warm()
 
-    def get_architecture_json(self, text_input: str) -> dict:
-        logger.info("🤖 [Bedrock] Calling Claude 3 Sonnet to process input text...")
-        
-        prompt = f"""
-        You are an expert system architect. Your task is to convert a natural language description
-        of a cloud architecture into a structured JSON object.
-
-        The JSON must have two top-level keys: "nodes" and "edges".
-
-        1.  **nodes**: A list of all components.
-            - `id`: A unique, simple Python-variable-safe string (e.g., "user", "alb", "rds_db").
-            - `label`: The text to display on the icon (e.g., "Application Load Balancer"). Do not use newlines.
-            - `type`: The type of the component. This is CRITICAL. Choose from this list:
-              - `aws.compute.ec2_auto_scaling`
-              - `aws.network.route53`, `aws.network.elb_application_load_balancer`
-              - `aws.storage.s3`
-              - `aws.database.rds_postgresql_instance`
-              - `user` (for human users)
-              - `generic_client` (for web browsers, mobile apps)
-
-        2.  **edges**: A list of connections between the nodes.
-            - `source`: The `id` of the starting node.
-            - `target`: The `id` of the ending node.
-            - `label`: A short description of the connection.
-
-        USER'S ARCHITECTURE DESCRIPTION:
-        ---
-        {text_input}
-        ---
+    def _warm(self):
+        """
+        Opens the HTTPS connection to Bedrock during Lambda init, so the first
+        request doesn't pay for the TLS handshake. Any response (including an
+        access-denied error) leaves a pooled connection behind, so failures are ignored.
         """
+        if not hasattr(self.client, 'list_async_invokes'):
+            # Older botocore releases don't have this operation, so nothing would be sent
+            logger.warning("⚠️ [Bedrock] botocore lacks ListAsyncInvokes; skipping connection warm-up.")
+            return
+        try:
+            self.client.list_async_invokes(maxResults=1)
+        except Exception as e:
+            logger.info(f"[Bedrock] Connection warm-up finished with: {e}")
+
+    def _cache_key(self, text_input: str) -> str:
+        digest = hashlib.sha256(text_input.encode('utf-8')).hexdigest()
+        # Include the model id so switching models doesn't serve stale output
+        return f"llm_cache/{self.model_id}/{digest}.json"
+
+    def _read_cache(self, key: str):
+        try:
+            response = self.s3_client.get_object(Bucket=self.cache_bucket, Key=key)
+            arch_data = _json_loads(response['Body'].read())
+            logger.info(f"⚡ [Bedrock] Cache hit for '{key}', skipping model call.")
+            return arch_data
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                logger.warning(f"⚠️ [Bedrock] Could not read cache entry '{key}': {e}")
+        except Exception as e:
+            logger.warning(f"⚠️ [Bedrock] Ignoring unreadable cache entry '{key}': {e}")
+        return None
+
+    def _write_cache(self, key: str, arch_data: dict):
+        try:
+            body = _json_dumps(arch_data)
+            self.s3_client.put_object(
+                Bucket=self.cache_bucket,
+                Key=key,
+                Body=body,
+                ContentLength=len(body),
+                ContentType='application/json'
+            )
+        except Exception as e:
+            # A failed cache write (including connection errors and timeouts, which
+            # are BotoCoreError rather than ClientError) must never fail the request itself
+            logger.warning(f"⚠️ [Bedrock] Could not write cache entry '{key}': {e}")
+
+    def get_architecture_json(self, text_input: str) -> dict:
+        cache_key = self._cache_key(text_input) if self.cache_bucket else None
+        if cache_key:
+            cached = self._read_cache(cache_key)
+            if cached is not None:
+                return cached
+
+        arch_data = self._invoke_model(text_input)
+        if cache_key:
+            self._write_cache(cache_key, arch_data)
+        return arch_data
+
+    def _invoke_model(self, text_input: str) -> dict:
+        logger.debug("🤖 [Bedrock] Calling Claude 3 Haiku to process input text...")
         
-        # Claude 3 Sonnet uses the "messages" API format
+        prompt = _ARCH_PROMPT_PREFIX + text_input + _ARCH_PROMPT_SUFFIX
+
+        # Claude 3 Haiku uses the "messages" API format
         request_body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 4096,
+            **_REQUEST_BODY_TEMPLATE,
             "messages": [
                 {
                     "role": "user",
@@ -73,22 +215,29 @@ class BedrockProcessor:
         }
 
         try:
-            response = self.client.invoke_model(
+            response = self.client.invoke_model_with_response_stream(
                 modelId=self.model_id,
-                body=json.dumps(request_body),
+                body=_json_dumps(request_body),
                 contentType='application/json',
                 accept='application/json'
             )
-            
-            response_body = json.loads(response['body'].read())
-            json_text = response_body['content'][0]['text']
-            
-            # Clean up potential markdown formatting from the response
-            cleaned_json_text = json_text.strip().replace("```json", "").replace("```", "")
-            return json.loads(cleaned_json_text)
+
+            # The forced tool call streams its input as partial JSON fragments;
+            # collect them as they arrive and parse once the message is complete
+            tool_input = []
+            for event in response['body']:
+                chunk = _json_loads(event['chunk']['bytes'])
+                if chunk['type'] == 'content_block_delta' and chunk['delta']['type'] == 'input_json_delta':
+                    tool_input.append(chunk['delta']['partial_json'])
+                elif chunk['type'] == 'message_stop':
+                    break
+
+            if not tool_input:
+                raise ValueError("Response did not contain an 'emit_architecture' tool call.")
+            return _json_loads("".join(tool_input))
             
         except ClientError as e:
-            logger.error(f"❌ [Bedrock] ClientError: Couldn't invoke model '{self.model_id}'. Check IAM permissions. Details: {e}")
+            logger.error(f"❌ [Bedrock] ClientError: Couldn't invoke model '{self.model_id}'. Check IAM permissions (bedrock:InvokeModelWithResponseStream). Details: {e}")
             raise Exception("Failed to invoke Bedrock model due to a client error.") from e
         except Exception as e:
             logger.error(f"❌ [Bedrock] Failed to generate or parse JSON from API response: {e}")
@@ -97,6 +246,46 @@ class BedrockProcessor:
 
 # --- Part 2: Direct draw.io XML Generation ---
 
+_NODE_STYLE = "rounded=1;whiteSpace=wrap;html=1;arcSize=12;"
+_EDGE_STYLE = "edgeStyle=orthogonalEdgeStyle;rounded=0;orthogonalLoop=1;jettySize=auto;html=1;endArrow=classic;endFill=1;"
+
+# Everything in a cell except its id, label, endpoints and position is the same
+# for every node/edge, so those fragments are formatted once here
+_NODE_CELL_ATTRS = f'style="{_NODE_STYLE}" parent="1" vertex="1"'
+_NODE_GEOMETRY_TAIL = 'width="120" height="80" as="geometry" /></mxCell>'
+_EDGE_CELL_ATTRS = f'style="{_EDGE_STYLE}" parent="1" edge="1"'
+_EDGE_GEOMETRY = '<mxGeometry relative="1" as="geometry" /></mxCell>'
+
+# Layout tier (top to bottom) for each known component type
+_TIERS = {
+    'user': 0, 'generic_client': 0, 'aws.network.route53': 1,
+    'aws.network.elb_application_load_balancer': 2,
+    'aws.compute.ec2_auto_scaling': 3,
+    'aws.database.rds_postgresql_instance': 4, 'aws.storage.s3': 4
+}
+_TIER_COUNT = 5
+_DEFAULT_TIER = 3 # Unknown types sit with the compute tier
+
+# The document structure is fixed, so it is written out directly instead of
+# building (and then serializing) an ElementTree of mxCell objects.
+_XML_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<mxfile host="app.diagrams.net" agent="doodle-ai">'
+    '<diagram id="diagram-1" name="Page-1">'
+    '<mxGraphModel dx="1400" dy="800" grid="1" gridSize="10" guides="1" tooltips="1" connect="1" arrows="1">'
+    '<root><mxCell id="0" /><mxCell id="1" parent="0" />'
+)
+_XML_TAIL = '</root></mxGraphModel></diagram></mxfile>'
+
+# Characters that must be escaped inside a double-quoted attribute value
+# (in addition to &, < and >, which saxutils.escape always handles)
+_ATTR_ENTITIES = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#09;"}
+
+
+def _attr(value):
+    return escape(str(value), _ATTR_ENTITIES)
+
+
 class DiagramGenerator:
     """
     Generates a draw.io compatible XML file from a structured
@@ -105,79 +294,181 @@ class DiagramGenerator:
     def __init__(self):
         self.cell_id_counter = 2
 
-    def _create_cell(self, parent_element, **attrs):
-        return ET.SubElement(parent_element, 'mxCell', {str(k): str(v) for k, v in attrs.items()})
-
-    def _create_node(self, root, node_id, label, x, y, width=120, height=80):
-        style = "rounded=1;whiteSpace=wrap;html=1;arcSize=12;"
-        cell = self._create_cell(root, id=node_id, value=label, style=style, parent="1", vertex="1")
-        ET.SubElement(cell, 'mxGeometry', {'x': str(x), 'y': str(y), 'width': str(width), 'height': str(height), 'as': 'geometry'})
+    def _create_node(self, parts, node_id, label, x, y):
+        parts.append(
+            f'<mxCell id="{node_id}" value="{_attr(label)}" {_NODE_CELL_ATTRS}>'
+            f'<mxGeometry x="{x}" y="{y}" {_NODE_GEOMETRY_TAIL}'
+        )
 
-    def _create_edge(self, root, source_node_id, target_node_id, label=""):
+    def _create_edge(self, parts, source_node_id, target_node_id, label=""):
         cell_id = self.cell_id_counter
         self.cell_id_counter += 1
-        style = "edgeStyle=orthogonalEdgeStyle;rounded=0;orthogonalLoop=1;jettySize=auto;html=1;endArrow=classic;endFill=1;"
-        cell = self._create_cell(root, id=cell_id, value=label, style=style, parent="1", edge="1", source=source_node_id, target=target_node_id)
-        ET.SubElement(cell, 'mxGeometry', {'relative': "1", 'as': 'geometry'})
+        parts.append(
+            f'<mxCell id="{cell_id}" value="{_attr(label)}" {_EDGE_CELL_ATTRS} '
+            f'source="{source_node_id}" target="{target_node_id}">{_EDGE_GEOMETRY}'
+        )
 
-    def generate_xml_string(self, data: dict):
-        logger.info("🎨 [XML Generator] Building reliable draw.io XML structure...")
+    def _build_parts(self, data: dict):
+        logger.debug("🎨 [XML Generator] Building reliable draw.io XML structure...")
         self.cell_id_counter = 2 # Reset for each invocation
-        mxfile = ET.Element('mxfile', host="app.diagrams.net", agent="doodle-ai")
-        diagram = ET.SubElement(mxfile, 'diagram', id="diagram-1", name="Page-1")
-        mxGraphModel = ET.SubElement(diagram, 'mxGraphModel', dx="1400", dy="800", grid="1", gridSize="10", guides="1", tooltips="1", connect="1", arrows="1")
-        root = ET.SubElement(mxGraphModel, 'root')
-        self._create_cell(root, id="0")
-        self._create_cell(root, id="1", parent="0")
+        parts = [_XML_HEAD]
+
+        # Each node gets a compact index into `cell_ids`, resolved once from its id
+        nodes = data.get('nodes', [])
+        id_to_idx = {node['id']: idx for idx, node in enumerate(nodes)}
+        cell_ids = [None] * len(nodes)
 
         # Simple tiered layout logic to position nodes automatically
-        tiers = {
-            'user': 0, 'generic_client': 0, 'aws.network.route53': 1,
-            'aws.network.elb_application_load_balancer': 2,
-            'aws.compute.ec2_auto_scaling': 3,
-            'aws.database.rds_postgresql_instance': 4, 'aws.storage.s3': 4
-        }
-        nodes_in_tier = {i: [] for i in range(5)}
-        for node in data.get('nodes', []):
-            tier = tiers.get(node['type'], 3)
-            nodes_in_tier[tier].append(node)
+        nodes_in_tier = tuple([] for _ in range(_TIER_COUNT))
+        get_tier = _TIERS.get
+        for idx, node in enumerate(nodes):
+            nodes_in_tier[get_tier(node['type'], _DEFAULT_TIER)].append((idx, node))
 
-        node_id_map = {}
         y_pos = 40
-        for i in range(5):
-            tier_count = len(nodes_in_tier[i])
+        for tier_nodes in nodes_in_tier:
+            tier_count = len(tier_nodes)
             if tier_count == 0: continue
             tier_width = tier_count * 180
-            x_pos = 600 - (tier_width / 2)
-            for node in nodes_in_tier[i]:
+            x_pos = 600 - (tier_width // 2) # Integer division keeps coordinates whole pixels
+            for idx, node in tier_nodes:
                 cell_id = self.cell_id_counter
-                node_id_map[node['id']] = cell_id
+                cell_ids[idx] = cell_id
                 self.cell_id_counter += 1
-                self._create_node(root, cell_id, node['label'], x_pos, y_pos)
+                self._create_node(parts, cell_id, node['label'], x_pos, y_pos)
                 x_pos += 180
             y_pos += 140
 
+        # Skip edges that reference unknown nodes; the target is only looked up
+        # when the source resolved (indices can be 0, hence the explicit None checks)
+        get_idx = id_to_idx.get
+        create_edge = self._create_edge
         for edge in data.get('edges', []):
-            source_cell_id = node_id_map.get(edge['source'])
-            target_cell_id = node_id_map.get(edge['target'])
-            if source_cell_id and target_cell_id:
-                self._create_edge(root, source_cell_id, target_cell_id, edge.get('label', ''))
+            source_idx = get_idx(edge['source'])
+            if source_idx is None: continue
+            target_idx = get_idx(edge['target'])
+            if target_idx is None: continue
+            create_edge(parts, cell_ids[source_idx], cell_ids[target_idx], edge.get('label', ''))
+
+        parts.append(_XML_TAIL)
+        return parts
 
-        rough_string = ET.tostring(mxfile, 'utf-8')
-        reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="  ")
+    def generate_xml_bytes(self, data: dict):
+        """Returns compact UTF-8 XML bytes, ready to upload as-is. draw.io ignores indentation."""
+        return "".join(self._build_parts(data)).encode('utf-8')
+
+
+# Upper bound on 'text_inputs' per request, so one call can't exhaust the
+# Lambda timeout or the Bedrock budget
+MAX_BATCH_SIZE = 16
 
 
 # --- Global Initializations (for Lambda warm starts) ---
 try:
-    bedrock_processor = BedrockProcessor()
+    s3_client = boto3.client('s3', config=_BOTO_CONFIG) # Initialize S3 client once
+    # LLM_CACHE_BUCKET is optional; when unset, every request calls Bedrock
+    bedrock_processor = BedrockProcessor(s3_client=s3_client, cache_bucket=os.environ.get('LLM_CACHE_BUCKET'))
     diagram_generator = DiagramGenerator()
-    s3_client = boto3.client('s3') # Initialize S3 client once
+    # Worker pools are shared across warm invocations; threads are only started on demand
+    bedrock_executor = ThreadPoolExecutor(max_workers=_BEDROCK_WORKERS) # Fans out per-input S3 lookups and Bedrock calls for batches
+    upload_executor = ThreadPoolExecutor(max_workers=_UPLOAD_WORKERS) # Uploads batch diagrams while the next one is built
 except Exception as e:
     logger.fatal(f"CRITICAL: Failed to initialize a processor or client: {e}")
     bedrock_processor = None
     diagram_generator = None
     s3_client = None
+    bedrock_executor = None
+    upload_executor = None
+# --------------------------------------------------------
+
+
+# --- Helpers ---
+# Bump whenever DiagramGenerator's output changes, so previously stored diagrams
+# are regenerated rather than served forever
+_DIAGRAM_FORMAT_VERSION = "1"
+
+
+def _diagram_file_name(text_input):
+    # The pipeline is deterministic in its input, the model and the generator
+    # version, so the file is named after a hash of all three
+    key = f"{bedrock_processor.model_id}\n{_DIAGRAM_FORMAT_VERSION}\n{text_input}"
+    return f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.drawio"
+
+
+def _diagram_exists(bucket_name, file_name):
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=file_name)
+        return True
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('404', 'NotFound', 'NoSuchKey'):
+            return False
+        if code in ('403', 'Forbidden', 'AccessDenied'):
+            # Without s3:GetObject/s3:ListBucket, S3 answers 403 even for a missing
+            # key; treat it as a miss so the function still works with put-only access
+            logger.warning(f"⚠️ No read access to s3://{bucket_name}/{file_name}; generating a new diagram.")
+            return False
+        raise
+
+
+def _put_diagram(bucket_name, file_name, xml_bytes):
+    # An explicit length lets the body go out as a single, non-chunked PUT
+    return s3_client.put_object(
+        Bucket=bucket_name,
+        Key=file_name,
+        Body=xml_bytes,
+        ContentLength=len(xml_bytes),
+        ContentType='application/xml'
+    )
+
+
+def _upload_diagram(bucket_name, file_name, xml_bytes):
+    return upload_executor.submit(_put_diagram, bucket_name, file_name, xml_bytes)
+
+
+def _diagram_location(bucket_name, file_name):
+    return {
+        "s3_uri": f"s3://{bucket_name}/{file_name}",
+        "s3_bucket": bucket_name,
+        "s3_key": file_name
+    }
+
+
+def _success_response(payload):
+    return {
+        "statusCode": 200,
+        "headers": {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*" # Add CORS header
+        },
+        "body": _json_dumps({"message": "Diagram created successfully.", **payload}).decode('utf-8')
+    }
+
+
+def _handle_batch(bucket_name, text_inputs):
+    """
+    Generates one diagram per input. Bedrock calls are I/O-bound, so they run
+    concurrently and the batch takes roughly as long as its slowest input.
+    """
+    # Identical inputs map to the same file, so each is only generated once
+    unique_inputs = list(dict.fromkeys(text_inputs))
+    file_names = [_diagram_file_name(text_input) for text_input in unique_inputs]
+    exists = bedrock_executor.map(lambda file_name: _diagram_exists(bucket_name, file_name), file_names)
+    pending = [(text_input, file_name) for text_input, file_name, found in zip(unique_inputs, file_names, exists) if not found]
+    logger.info(f"Batch of {len(text_inputs)} inputs: {len(pending)} diagram(s) to generate.")
+
+    arch_results = bedrock_executor.map(bedrock_processor.get_architecture_json, [text_input for text_input, _ in pending])
+    # XML is built on this thread (DiagramGenerator keeps per-diagram state) while
+    # earlier diagrams upload in the background
+    uploads = [
+        _upload_diagram(bucket_name, file_name, diagram_generator.generate_xml_bytes(arch_data))
+        for (_, file_name), arch_data in zip(pending, arch_results)
+    ]
+    for upload in uploads:
+        upload.result()
+
+    # One location per input, in request order
+    locations = {text_input: _diagram_location(bucket_name, file_name) for text_input, file_name in zip(unique_inputs, file_names)}
+    return _success_response({"diagrams": [locations[text_input] for text_input in text_inputs]})
 # --------------------------------------------------------
 
 
@@ -189,60 +480,71 @@ def lambda_handler(event, context):
     {
         "text_input": "Your architecture description..."
     }
+    or, to generate several diagrams in one invocation:
+    {
+        "text_inputs": ["First description...", "Second description..."]
+    }
     """
-    if not all([bedrock_processor, diagram_generator, s3_client]):
+    if not all([bedrock_processor, diagram_generator, s3_client, bedrock_executor, upload_executor]):
         return {"statusCode": 500, "headers": {"Content-Type": "application/json"}, "body": json.dumps({"error": "Service is not available due to an initialization failure."})}
     
-    # Get S3 bucket name from environment variables for flexibility
+    # Get S3 bucket name from environment variables for flexibility.
+    # The function needs s3:PutObject on it; s3:GetObject and s3:ListBucket are
+    # also needed to reuse diagrams for repeated inputs (otherwise each request
+    # regenerates its diagram). Bedrock is called with a streaming request, so the
+    # role also needs bedrock:InvokeModelWithResponseStream on the model;
+    # bedrock:InvokeModel alone is not enough.
     bucket_name = os.environ.get('DIAGRAM_BUCKET')
     if not bucket_name:
         logger.error("FATAL: DIAGRAM_BUCKET environment variable not set.")
         return {"statusCode": 500, "headers": {"Content-Type": "application/json"}, "body": json.dumps({"error": "Server is not configured correctly."})}
 
     try:
-        logger.info(f"Received event: {json.dumps(event)}")
-        body = json.loads(event.get('body', '{}'))
+        # Serializing the whole API Gateway event is costly, so only do it when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Received event: {json.dumps(event)}")
+        # API Gateway sends "body": null for body-less requests
+        body = _json_loads(event.get('body') or '{}')
+
+        text_inputs = body.get('text_inputs')
+        if text_inputs is not None:
+            if not (isinstance(text_inputs, list) and text_inputs and all(isinstance(t, str) and t for t in text_inputs)):
+                logger.error("Validation Error: 'text_inputs' must be a non-empty list of strings.")
+                return {"statusCode": 400, "headers": {"Content-Type": "application/json"}, "body": json.dumps({"error": "'text_inputs' must be a non-empty list of non-empty strings."})}
+            if len(text_inputs) > MAX_BATCH_SIZE:
+                logger.error(f"Validation Error: batch of {len(text_inputs)} exceeds the limit of {MAX_BATCH_SIZE}.")
+                return {"statusCode": 400, "headers": {"Content-Type": "application/json"}, "body": json.dumps({"error": f"'text_inputs' may contain at most {MAX_BATCH_SIZE} entries."})}
+            return _handle_batch(bucket_name, text_inputs)
+
         text_input = body.get('text_input')
 
         if not text_input:
             logger.error("Validation Error: 'text_input' not found in request body.")
             return {"statusCode": 400, "headers": {"Content-Type": "application/json"}, "body": json.dumps({"error": "Request body must be a JSON object with a 'text_input' key."})}
 
+        if not isinstance(text_input, str):
+            logger.error("Validation Error: 'text_input' must be a string.")
+            return {"statusCode": 400, "headers": {"Content-Type": "application/json"}, "body": json.dumps({"error": "'text_input' must be a string."})}
+
         # --- Main Application Flow ---
+        # 0. Return the existing diagram if this input was seen before
+        file_name = _diagram_file_name(text_input)
+        if _diagram_exists(bucket_name, file_name):
+            logger.info(f"⚡ Diagram already exists at s3://{bucket_name}/{file_name}, skipping generation.")
+            return _success_response(_diagram_location(bucket_name, file_name))
+
         # 1. Get structured data from Bedrock
         arch_data = bedrock_processor.get_architecture_json(text_input)
         
-        # 2. Generate the XML content for the diagram
-        xml_content = diagram_generator.generate_xml_string(arch_data)
+        # 2. Generate the XML content for the diagram (already UTF-8 encoded)
+        xml_bytes = diagram_generator.generate_xml_bytes(arch_data)
 
         # 3. Save the XML file to S3
-        # Use the Lambda request ID for a unique filename to prevent overwrites
-        file_name = f"{context.aws_request_id}.drawio"
-        
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=file_name,
-            Body=xml_content.encode('utf-8'), # S3 expects bytes
-            ContentType='application/xml'
-        )
-        
-        s3_uri = f"s3://{bucket_name}/{file_name}"
-        logger.info(f"✅ Success! Diagram saved to {s3_uri}")
+        _put_diagram(bucket_name, file_name, xml_bytes)
+        logger.info(f"✅ Success! Diagram saved to s3://{bucket_name}/{file_name}")
 
         # 4. Return a success response with the S3 location
-        return {
-            "statusCode": 200,
-            "headers": {
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Origin": "*" # Add CORS header
-            },
-            "body": json.dumps({
-                "message": "Diagram created successfully.",
-                "s3_uri": s3_uri,
-                "s3_bucket": bucket_name,
-                "s3_key": file_name
-            })
-        }
+        return _success_response(_diagram_location(bucket_name, file_name))
 
     except json.JSONDecodeError:
         logger.error("Error decoding JSON from event body.")
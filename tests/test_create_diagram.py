@@ -0,0 +1,212 @@
+import json
+import os
+import sys
+import types
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as ET
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Stand-ins for botocore when it isn't installed; boto3.client is always
+# replaced below, so importing the module never touches AWS
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    class ClientError(Exception):
+        def __init__(self, error_response, operation_name):
+            super().__init__(error_response['Error']['Code'])
+            self.response = error_response
+
+    boto3 = types.ModuleType('boto3')
+    config_stub = types.ModuleType('botocore.config')
+    config_stub.Config = lambda **kwargs: kwargs
+    exceptions_stub = types.ModuleType('botocore.exceptions')
+    exceptions_stub.ClientError = ClientError
+    sys.modules.update({
+        'boto3': boto3,
+        'botocore': types.ModuleType('botocore'),
+        'botocore.config': config_stub,
+        'botocore.exceptions': exceptions_stub,
+    })
+
+_real_client = getattr(boto3, 'client', None)
+boto3.client = lambda *args, **kwargs: types.SimpleNamespace()
+try:
+    import create_diagram  # noqa: E402
+finally:
+    if _real_client is not None:
+        boto3.client = _real_client
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+
+class FakeBedrock:
+    model_id = 'test-model'
+
+    def __init__(self):
+        self.calls = []
+
+    def get_architecture_json(self, text_input):
+        self.calls.append(text_input)
+        return {"nodes": [{"id": "n", "label": text_input, "type": "user"}], "edges": []}
+
+
+@pytest.fixture
+def handler_env(monkeypatch):
+    # Replace every module global the handler relies on, so the tests don't
+    # depend on what module initialization managed to set up
+    s3, bedrock = FakeS3(), FakeBedrock()
+    bedrock_executor, upload_executor = ThreadPoolExecutor(max_workers=2), ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(create_diagram, 's3_client', s3)
+    monkeypatch.setattr(create_diagram, 'bedrock_processor', bedrock)
+    monkeypatch.setattr(create_diagram, 'diagram_generator', create_diagram.DiagramGenerator())
+    monkeypatch.setattr(create_diagram, 'bedrock_executor', bedrock_executor)
+    monkeypatch.setattr(create_diagram, 'upload_executor', upload_executor)
+    monkeypatch.setenv('DIAGRAM_BUCKET', 'bucket')
+    yield s3, bedrock
+    bedrock_executor.shutdown()
+    upload_executor.shutdown()
+
+
+def _invoke(body):
+    response = create_diagram.lambda_handler({'body': json.dumps(body)}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def test_batch_preserves_order_and_generates_duplicates_once(handler_env):
+    s3, bedrock = handler_env
+    s3.objects[create_diagram._diagram_file_name('cached')] = b'<mxfile />'
+
+    status, body = _invoke({'text_inputs': ['a', 'cached', 'b', 'a']})
+
+    assert status == 200
+    expected_keys = [create_diagram._diagram_file_name(t) for t in ['a', 'cached', 'b', 'a']]
+    assert [d['s3_key'] for d in body['diagrams']] == expected_keys
+    assert sorted(bedrock.calls) == ['a', 'b']
+    assert set(s3.objects) == set(expected_keys)
+
+
+def test_batch_above_limit_is_rejected(handler_env):
+    _, bedrock = handler_env
+
+    status, _ = _invoke({'text_inputs': [str(i) for i in range(create_diagram.MAX_BATCH_SIZE + 1)]})
+
+    assert status == 400
+    assert bedrock.calls == []
+
+
+def test_non_string_text_input_is_a_client_error(handler_env):
+    _, bedrock = handler_env
+
+    status, _ = _invoke({'text_input': 123})
+
+    assert status == 400
+    assert bedrock.calls == []
+
+
+def test_null_body_is_a_client_error(handler_env):
+    response = create_diagram.lambda_handler({'body': None}, None)
+
+    assert response['statusCode'] == 400
+
+
+def test_edges_with_unknown_endpoints_are_skipped():
+    data = {
+        "nodes": [
+            {"id": "user", "label": "User", "type": "user"},
+            {"id": "alb", "label": "ALB", "type": "aws.network.elb_application_load_balancer"},
+        ],
+        "edges": [
+            {"source": "user", "target": "alb", "label": "https"},
+            {"source": "missing", "target": "alb"},
+            {"source": "user", "target": "missing"},
+        ],
+    }
+
+    root = ET.fromstring(create_diagram.DiagramGenerator().generate_xml_bytes(data))
+    cells = {cell.get('value'): cell for cell in root.iter('mxCell')}
+    edges = [cell for cell in root.iter('mxCell') if cell.get('edge') == '1']
+
+    assert len(edges) == 1
+    assert edges[0].get('source') == cells['User'].get('id')
+    assert edges[0].get('target') == cells['ALB'].get('id')
+
+
+def test_labels_with_special_characters_round_trip():
+    node_label = 'Say "hi" & <wave>\nsecond line\tand a tab'
+    edge_label = "'single' & \"double\" > less <"
+    data = {
+        "nodes": [
+            {"id": "a", "label": node_label, "type": "user"},
+            {"id": "b", "label": "B", "type": "aws.storage.s3"},
+        ],
+        "edges": [{"source": "a", "target": "b", "label": edge_label}],
+    }
+
+    root = ET.fromstring(create_diagram.DiagramGenerator().generate_xml_bytes(data))
+    values = [cell.get('value') for cell in root.iter('mxCell') if cell.get('value') is not None]
+
+    assert values == [node_label, 'B', edge_label]
+
+
+class FakeStreamClient:
+    def __init__(self, events):
+        self.events = events
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return {'body': ({'chunk': {'bytes': json.dumps(event).encode('utf-8')}} for event in self.events)}
+
+
+def _json_delta(fragment):
+    return {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'input_json_delta', 'partial_json': fragment}}
+
+
+def _processor(monkeypatch, events):
+    monkeypatch.setattr(create_diagram.boto3, 'client', lambda *args, **kwargs: FakeStreamClient(events), raising=False)
+    return create_diagram.BedrockProcessor()
+
+
+def test_stream_joins_tool_input_fragments_until_message_stop(monkeypatch):
+    events = [
+        {'type': 'message_start', 'message': {}},
+        {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'tool_use', 'name': 'emit_architecture', 'input': {}}},
+        _json_delta('{"nod'),
+        _json_delta('es": [{"id": "u", "lab'),
+        _json_delta('el": "User", "type": "us'),
+        _json_delta('er"}], "edges": []}'),
+        {'type': 'content_block_stop', 'index': 0},
+        {'type': 'message_stop'},
+        # Anything after message_stop must be ignored
+        _json_delta('garbage'),
+    ]
+
+    arch_data = _processor(monkeypatch, events).get_architecture_json('a user')
+
+    assert arch_data == {"nodes": [{"id": "u", "label": "User", "type": "user"}], "edges": []}
+
+
+def test_stream_without_tool_call_raises(monkeypatch):
+    events = [
+        {'type': 'message_start', 'message': {}},
+        {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}},
+        {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': 'no tool'}},
+        {'type': 'content_block_stop', 'index': 0},
+        {'type': 'message_stop'},
+    ]
+
+    with pytest.raises(Exception, match="valid response"):
+        _processor(monkeypatch, events).get_architecture_json('a user')